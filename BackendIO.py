@@ -5,8 +5,112 @@
 # .json files and run it.                      #
 # Alternatively, call the #register function   #
 ################################################
-import glob, json, requests, os
+import asyncio, fnmatch, functools, gzip, json, logging, mmap, os, stat, types
+from concurrent.futures import ThreadPoolExecutor
 from requests import Session
+from requests.adapters import HTTPAdapter
+
+# Logger for all BackendIO instances. Output is left to the logging configuration of the application,
+# e.g. `logging.basicConfig(level=logging.INFO)`. Each instance decides which messages it logs.
+__logger__ = logging.getLogger("BackendIO")
+
+# Optional, only required for the async methods
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Optional, speeds up loading and sending patterns
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def __json_dumps__(data) -> bytes:
+    """Serializes data to compact json bytes, using orjson if it is installed.
+
+    Args:
+    - data: The data to serialize.
+
+    Returns:
+    - `bytes`: The json bytes.
+    """
+    if orjson is not None:
+        # Patterns may use non-str keys, which requests' json= accepted
+        try:
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(data, separators=(',', ':')).encode()
+
+# Default headers for the sessions. Read-only, as the default is shared by all instances.
+__JSON_HEADERS__ = types.MappingProxyType({'Content-Type': 'application/json'})
+
+
+def __pattern_body__(pattern_name: str, force_now: bool) -> bytes:
+    """Builds the json body of a pattern request from a template, without serializing a dictionary.
+
+    Args:
+    - pattern_name (`str`): The name of the pattern.
+    - force_now (`bool`): Whether to force the pattern to be transmitted now.
+
+    Returns:
+    - `bytes`: The json body.
+    """
+    return b'{"pattern_name":%b,"force_now":%b}' % (__json_dumps__(pattern_name), b'true' if force_now else b'false')
+
+
+def __encoding_body__(encoding_pattern: str, force_now: bool) -> bytes:
+    """Builds the json body of an encoding request from a template, without serializing a dictionary.
+
+    Args:
+    - encoding_pattern (`str`): The encoding pattern string.
+    - force_now (`bool`): Whether to force the encoding to be transmitted now.
+
+    Returns:
+    - `bytes`: The json body.
+    """
+    return b'{"encoding":{"pattern":%b,"force_now":%b}}' % (__json_dumps__(encoding_pattern), b'true' if force_now else b'false')
+
+
+def __load_json_file__(file: str):
+    """Loads a json file.
+    Memory-maps the file when orjson is installed, so it is parsed straight from the page cache.
+
+    Args:
+    - file (`str`): The path to the json file.
+
+    Returns:
+    - The parsed json data.
+    """
+    with open(file, "rb") as f:
+        # The stdlib parser can't read from a memory map, and empty files can't be mapped
+        if orjson is None or os.fstat(f.fileno()).st_size == 0:
+            return json.loads(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            return orjson.loads(view)
+
+
+@functools.lru_cache(maxsize=8)
+def __list_files__(directory: str, mask: str, mtime: int) -> 'tuple[tuple[str, str]]':
+    """Lists the files in a directory whose name matches a glob mask.
+    Cached per directory modification time, so adding, removing or renaming files invalidates the listing.
+
+    Args:
+    - directory (`str`): The directory to list.
+    - mask (`str`): The glob mask the file names must match, e.g. `*.json`.
+    - mtime (`int`): The modification time of the directory in nanoseconds, only used as cache key.
+
+    Returns:
+    - `tuple[tuple[str, str]]`: The name without extension and the path of each file.
+    """
+    return tuple(
+        (os.path.splitext(entry.name)[0], entry.path)
+        for entry in os.scandir(directory)
+        if fnmatch.fnmatch(entry.name, mask) and entry.is_file()
+    )
+
 
 class BackendIO:
     """Interface with the backend
@@ -19,48 +123,66 @@ class BackendIO:
     """
 
     # Configurable
-    __use_session__ = False
+    __use_session__ = True
     __address__: str = None
     __port__: int = None
     __log_info__ = True
     __log_verbose__ = False
 
+    # URLs, computed once in #__init__
+    __url_base__: str = None
+    __url_pattern__: str = None
+    __url_encoding__: str = None
+
     # Session
+    __headers__: 'dict[str, str]' = None
     __session__: Session = None
+    __aio_session__ = None
+    __aio_loop__: asyncio.AbstractEventLoop = None
 
     def __init__(
             self,
-            use_session: bool = False,
+            use_session: bool = True,
             address: str = "http://localhost:",
             port: int = 8000,
-            headers: 'dict[str, str]' = {'Content-Type' : 'application/json'},
+            headers: 'dict[str, str]' = None,
             log_info: bool = True,
             log_verbose: bool = False
     ):
         """Initializes the class.
 
         Args:
-        - use_session (`bool`): whether to use a session for the requests.
-                Makes transmission faster, but it occupies the connection,
-                which may cause problems when using multiple instances.
-                Defaults to `False`.
+        - use_session (`bool`, optional): Kept for backwards compatibility and ignored.
+                A pooled session is always used, so connections to the backend are kept alive
+                between requests. Defaults to `True`.
         - address (`str`, optional): The address to the backend. Defaults to `http://localhost:`
         - port (`int`, optional): The port of the backend. Defaults to `8000`
         - headers (`dict[str, str]`, optional): The headers to use for the requests.
-                Defaults to `{'Content-Type' : 'application/json'}`.
-                Ignored if `use_session` is `False`.
+                Defaults to `{'Content-Type' : 'application/json'}`, which is also added when missing.
         - log_info (`bool`, optional): Whether to log info messages. Defaults to `True`.
-        - log_verbose (`bool`, optional): Whether to log verbose messages. Defaults to `False`.
+        - log_verbose (`bool`, optional): Whether to log verbose (debug) messages. Defaults to `False`.
+
+        Messages are logged to the `BackendIO` logger, at the `INFO` and `DEBUG` levels respectively.
         """
         self.__use_session__ = use_session
         self.__address__ = address
         self.__port__ = port
+        self.__url_base__ = self.__make_url__()
+        self.__url_pattern__ = self.__url_base__ + "/devices/pattern"
+        self.__url_encoding__ = self.__url_base__ + "/devices/encoding"
         self.__log_info__ = log_info
         self.__log_verbose__ = log_verbose
+        self.__logger__ = __logger__
 
-        if self.__use_session__:
-            self.__session__ = Session()
-            self.__session__.headers.update(headers)
+        # Headers shared by the sync and async sessions. Bodies are sent as raw json bytes,
+        # so a json Content-Type is added unless the caller set their own.
+        self.__headers__ = dict(headers if headers is not None else __JSON_HEADERS__)
+        self.__headers__.setdefault('Content-Type', 'application/json')
+
+        # Keep-alive session, reuses connections to the backend between requests
+        self.__session__ = Session()
+        self.__session__.headers.update(self.__headers__)
+        self.__session__.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=20))
 
     def __make_url__(self):
         """Returns the URL to the backend.
@@ -71,69 +193,124 @@ class BackendIO:
         return self.__address__ + str(self.__port__)
     
     def __del__(self):
-        """Deletes the session."""
-        if self.__use_session__ and self.__session__ is not None:
+        """Deletes the sessions."""
+        if self.__aio_session__ is not None:
+            self.__discard_aio__()
+        if self.__session__ is not None:
             self.__session__.close()
-            self.__info__("Deleted BackendIO session.")
-
-    def __info__(self, message: str):
-        """Logs an info message.
-
-        Args:
-        - message (`str`): The message to log.
-        """
-        if self.__log_info__:
-            print(message)
+            if self.__log_verbose__:
+                self.__logger__.debug("Deleted BackendIO session.")
 
-    def __verbose__(self, message: str):
-        """Logs a verbose message.
+    def __aio__(self):
+        """Returns the async session, creating it on first use.
+        The session is bound to the event loop that created it, so a new one is made when the running loop changes.
 
-        Args:
-        - message (`str`): The message to log.
+        Returns:
+        - `aiohttp.ClientSession`: The async session.
         """
-        if self.__log_verbose__:
-            print(message)
-
-    def register_patterns(self, patterns: 'list[(str, str)]' = [], path = "\*.json") -> 'tuple(int, "list[str]")':
+        loop = asyncio.get_running_loop()
+        if self.__aio_session__ is not None and self.__aio_loop__ is not loop:
+            self.__discard_aio__()
+        if self.__aio_session__ is None:
+            if aiohttp is None:
+                raise ImportError("The async methods require aiohttp. Please install it with `pip install aiohttp`.")
+            self.__aio_session__ = aiohttp.ClientSession(
+                base_url=self.__url_base__,
+                headers=self.__headers__
+            )
+            self.__aio_loop__ = loop
+        return self.__aio_session__
+
+    def __discard_aio__(self):
+        """Closes the async session from outside its event loop, as far as that loop still allows."""
+        session, loop = self.__aio_session__, self.__aio_loop__
+        self.__aio_session__ = None
+        self.__aio_loop__ = None
+        if session is None or session.closed:
+            return
+        if loop.is_closed():
+            # The connections can't be closed without their loop, aiohttp reports them as unclosed.
+            # Await #close before the loop closes to avoid this.
+            session.detach()
+        elif loop.is_running():
+            asyncio.run_coroutine_threadsafe(session.close(), loop)
+        elif asyncio._get_running_loop() is not None:
+            # Another loop is running in this thread, so the old one can't be run to close the session
+            session.detach()
+        else:
+            loop.run_until_complete(session.close())
+
+    @classmethod
+    def clear_cache(cls):
+        """Clears the cached directory listings used by #register_patterns.
+        Only needed on file systems with a coarse modification time, listings are refreshed when a directory changes."""
+        __list_files__.cache_clear()
+
+    async def close(self):
+        """Closes the async session, if it was opened.
+        Await this before the event loop used for the async methods is closed."""
+        if self.__aio_session__ is not None:
+            await self.__aio_session__.close()
+            self.__aio_session__ = None
+            self.__aio_loop__ = None
+
+    def register_patterns(self, patterns: 'list[(str, str)]' = None, path = "\*.json", compress: bool = False) -> 'tuple(int, "list[str]")':
         """Registers patterns to the backend.\n
         - Uses patterns in the `patterns` argument.
         - Uses `.json` found in the 'current-working-directory/path'.
         - See https://github.com/teamhart-nl/vibration-engine#register
 
         Args:
-        - patterns (`list[(str, str)]`, optional): The patterns to register. Defaults to `[]`.
+        - patterns (`list[(str, str)]`, optional): The patterns to register. Defaults to none.
                     Must be a list of tuples, where the first element is the name of the pattern
                     and the second element is the json string.
         - path (`str`, optional): the path to the json files from the cwd. Defaults to `*.json`.
+                    Wildcards are only supported in the file name, e.g. `patterns/*.json`.
+                    Directory listings are cached until the directory changes.
+        - compress (`bool`, optional): Whether to gzip the request body.
+                    Only enable this if the backend accepts `Content-Encoding: gzip`. Defaults to `False`.
 
         Returns:
         - `tuple(int, list[str])`: The return code and the registered patterns.
         """
-        self.__verbose__("Registering patterns. Patterns: {}, Path: {}".format(patterns, path))
+        if patterns is None:
+            patterns = ()
+        if self.__log_verbose__:
+            self.__logger__.debug("Registering patterns. Patterns: %s, Path: %s", patterns, path)
 
         # Load all .json files in the cwd
-        files = glob.glob(os.getcwd() + path)
+        directory, mask = os.path.split(path.replace("\\", "/").lstrip("/"))
+        directory = os.path.join(os.getcwd(), directory)
+        try:
+            directory_stat = os.stat(directory)
+        except OSError:
+            directory_stat = None
+        if directory_stat is not None and stat.S_ISDIR(directory_stat.st_mode):
+            files = __list_files__(directory, mask, directory_stat.st_mtime_ns)
+        else:
+            files = ()
 
-        # If there are none, print a message and exit
+        # If there are none, log a message and exit
         if len(files) == 0:
-            self.__info__("No .json files found in the {} directory to register.".format(os.getcwd() + path))
+            if self.__log_info__:
+                self.__logger__.info("No .json files found in the %s directory to register.", os.path.join(directory, mask))
             return
 
-        # Create the dictionary
+        # Load the files in parallel, file reads release the GIL
+        with ThreadPoolExecutor(max_workers=min(32, len(files))) as executor:
+            loaded = list(executor.map(__load_json_file__, [file for _, file in files]))
+
+        # Create the dictionary with the data of each file
         register_datapacket = {
-            "patterns": []
+            "patterns": [
+                {
+                    "pattern_name": name,
+                    "pattern": data
+                }
+                for (name, _), data in zip(files, loaded)
+            ]
         }
 
-        # For each file load the data and add it to the dictionary
-        for file in files:
-            data = json.load(open(file))
-
-            # Add the data to the dictionary
-            register_datapacket['patterns'].append({
-                "pattern_name": file.replace('.json', '').replace("\\", "/").split("/")[-1],
-                "pattern": data
-            })
-
         # Add the patterns to the dictionary
         for pattern in patterns:
             register_datapacket['patterns'].append({
@@ -141,19 +318,24 @@ class BackendIO:
                 "pattern": pattern[1]
             })
 
-        self.__info__("Registering {} patterns".format(len(register_datapacket['patterns'])))
-        self.__verbose__("Patterns: {}".format(
-            ", ".join([pattern['pattern_name'] for pattern in register_datapacket['patterns']])
-        ))
+        if self.__log_info__:
+            self.__logger__.info("Registering %d patterns", len(register_datapacket['patterns']))
+        if self.__log_verbose__ and self.__logger__.isEnabledFor(logging.DEBUG):
+            self.__logger__.debug("Patterns: %s", ", ".join([pattern['pattern_name'] for pattern in register_datapacket['patterns']]))
+
+        # Serialize the datapacket compactly, and compress it if requested
+        body = __json_dumps__(register_datapacket)
+        headers = None
+        if compress:
+            body = gzip.compress(body)
+            headers = {'Content-Encoding': 'gzip'}
 
         # Make a post request to the API
-        if self.__use_session__:
-            r = self.__session__.post(self.__make_url__(), json=register_datapacket)
-        else:
-            r = requests.post(self.__make_url__(), json=register_datapacket)
+        r = self.__session__.post(self.__url_base__, data=body, headers=headers)
         code = r.status_code
 
-        self.__verbose__("Registered patterns. Return code: {}, Patterns: {}".format(code, register_datapacket['patterns']))
+        if self.__log_verbose__:
+            self.__logger__.debug("Registered patterns. Return code: %s, Patterns: %s", code, register_datapacket['patterns'])
 
         return code, register_datapacket['patterns']
     
@@ -169,15 +351,9 @@ class BackendIO:
         Returns:
         - `int`: The return code.
         """
-        payload = {
-            "pattern_name": pattern_name,
-            "force_now": force_now
-        }
-        self.__info__("Transmitting pattern. Pattern: {}, Force now: {}".format(pattern_name, force_now))
-        if self.__use_session__:
-            r = self.__session__.post(self.__make_url__() + "/devices/pattern", json=payload)
-        else:
-            r = requests.post(self.__make_url__() + "/devices/pattern", json=payload)
+        if self.__log_info__:
+            self.__logger__.info("Transmitting pattern. Pattern: %s, Force now: %s", pattern_name, force_now)
+        r = self.__session__.post(self.__url_pattern__, data=__pattern_body__(pattern_name, force_now))
         return r.status_code
 
     def encoding(self, encoding_pattern: str, force_now: bool = False) -> int:
@@ -193,21 +369,64 @@ class BackendIO:
         - `int`: The return code.
         """
         # Make a post request to the API
-        datapacket = {
-            "encoding": {
-                "pattern": encoding_pattern,
-                "force_now": force_now
-            }
-        }
-        self.__info__("Transmitting encoding. Datapacket: {}".format(datapacket))
-        if self.__use_session__:
-            r = self.__session__.post(self.__make_url__() + "/devices/encoding", json=datapacket)
-        else:
-            r = requests.post(self.__make_url__() + "/devices/encoding", json=datapacket)
+        if self.__log_info__:
+            self.__logger__.info("Transmitting encoding. Encoding: %s, Force now: %s", encoding_pattern, force_now)
+        r = self.__session__.post(self.__url_encoding__, data=__encoding_body__(encoding_pattern, force_now))
         code = r.status_code
 
         return code
+
+    async def pattern_async(self, pattern_name: str, force_now: bool = False) -> int:
+        """Transmits a pattern to the backend without blocking the event loop.
+        See #pattern. Requires `aiohttp`.
+
+        Args:
+        - pattern_name (`str`): The name of the pattern to transmit.
+        - force_now (`bool`, optional): Whether to force the pattern to be transmitted now.
+                Removes the queue of patterns. Defaults to `False`.
+
+        Returns:
+        - `int`: The return code.
+        """
+        if self.__log_info__:
+            self.__logger__.info("Transmitting pattern. Pattern: %s, Force now: %s", pattern_name, force_now)
+        async with self.__aio__().post("/devices/pattern", data=__pattern_body__(pattern_name, force_now)) as r:
+            return r.status
+
+    async def encoding_async(self, encoding_pattern: str, force_now: bool = False) -> int:
+        """Transmits an encoding to the backend without blocking the event loop.
+        See #encoding. Requires `aiohttp`.
+
+        Args:
+        - encoding_pattern (`str`): The encoding pattern string
+        - force_now (`bool`, optional): Whether to force the encoding to be transmitted now.
+                Removes the queue of encodings. Defaults to `False`.
+
+        Returns:
+        - `int`: The return code.
+        """
+        if self.__log_info__:
+            self.__logger__.info("Transmitting encoding. Encoding: %s, Force now: %s", encoding_pattern, force_now)
+        async with self.__aio__().post("/devices/encoding", data=__encoding_body__(encoding_pattern, force_now)) as r:
+            return r.status
+
+    async def gather_patterns(self, pattern_names: 'list[str]', force_now: bool = False) -> 'list[int]':
+        """Transmits multiple patterns to the backend concurrently.
+        Requires `aiohttp`.
+
+        Args:
+        - pattern_names (`list[str]`): The names of the patterns to transmit.
+        - force_now (`bool`, optional): Whether to force the patterns to be transmitted now.
+                Defaults to `False`.
+
+        Returns:
+        - `list[int]`: The return codes, in the order of `pattern_names`.
+        """
+        return list(await asyncio.gather(
+            *[self.pattern_async(pattern_name, force_now) for pattern_name in pattern_names]
+        ))
     
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     BackendIO(use_session=True).register_patterns()
\ No newline at end of file
@@ -1,6 +1,13 @@
+import atexit
 import json
 import os
 
+# Optional, used to read and write the config file faster
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # File all configs are stored in
 __CONFIG_FILE__ = "config.json"
 
@@ -16,21 +23,60 @@ __DEFAULT_CONFIG__ = {
 }
 
 # Types allowed to be included in the configuration file
-__CONFIGURABLE_TYPES__ = [dict, str, int, float, bool, tuple]
+__CONFIGURABLE_TYPES__ = frozenset([dict, str, int, float, bool, tuple])
 
 # The dictionary mirror of the configuration file.
 # Do not access this variable externally without also calling #save_config()
-__CONFIGURABLES__ = json.loads("\n".join(open(__CONFIG_FILE__, "r").readlines())) if os.path.exists(__CONFIG_FILE__) else __DEFAULT_CONFIG__
+def __load_config__() -> dict:
+    """Load the configuration file, or the default configuration if there is none"""
+    if not os.path.exists(__CONFIG_FILE__):
+        return __DEFAULT_CONFIG__
+    with open(__CONFIG_FILE__, "rb") as f:
+        return (orjson or json).loads(f.read())
+
+__CONFIGURABLES__ = __load_config__()
 if "use-config" not in __CONFIGURABLES__ or not __CONFIGURABLES__["use-config"]:
     __CONFIGURABLES__ = __DEFAULT_CONFIG__
 
 # Whether to debug print any new registrations
 __PRINT_REGISTRATIONS__ = False
 
+# Whether the configuration has changed since it was last saved.
+# Changes are written to disk once, when the program exits.
+__CONFIG_DIRTY__ = False
+
 
 class Configurable:
     """Stores fields in any class to the global configuration of the program"""
 
+    # Names of the configurable class fields, computed once per class in #__init_subclass__.
+    # Recomputed when the number of class attributes changes, e.g. when a field is added after class creation.
+    __configurable_keys__: 'tuple[str]' = ()
+    __configurable_attr_count__: int = -1
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        cls.__scan_configurable_keys__()
+
+    @classmethod
+    def __scan_configurable_keys__(cls) -> None:
+        """Collect the names of the configurable class fields"""
+
+        # Later entries override earlier ones so subclasses take precedence
+        fields = {}
+        for klass in reversed(cls.__mro__):
+            fields.update(vars(klass))
+        cls.__configurable_keys__ = tuple(
+            key for key, value in fields.items()
+            if not key.startswith("_") and type(value) in __CONFIGURABLE_TYPES__
+        )
+        cls.__configurable_attr_count__ = cls.__count_class_attrs__()
+
+    @classmethod
+    def __count_class_attrs__(cls) -> int:
+        """Count the attributes of the class and its bases"""
+        return sum(len(vars(klass)) for klass in cls.__mro__)
+
     def __init__(self, section: str = "", **kwargs) -> None:
 
         # Name
@@ -52,24 +98,30 @@ class Configurable:
         configured = 0
         default = 0
 
+        # Class fields are known from #__init_subclass__, only instance fields need to be scanned
+        cls = type(self)
+        if cls.__configurable_attr_count__ != cls.__count_class_attrs__():
+            cls.__scan_configurable_keys__()
+        keys = dict.fromkeys(self.__configurable_keys__)
+        keys.update(dict.fromkeys(key for key in vars(self) if not key.startswith("_")))
+
         # Add configurable attributes that are missing from defaults
-        for key in self.__dir__():
-            if key.startswith("_"):
-                continue
-            value = self.__getattribute__(key)
+        for key in keys:
+            value = getattr(self, key)
             if type(value) not in __CONFIGURABLE_TYPES__:
                 continue
             if key not in c:
                 c[key] = value
                 default += 1
             else:
-                self.__setattr__(key, c[key])
+                setattr(self, key, c[key])
                 configured += 1
 
 
-        # Save the config file if any edits were made
+        # Mark the config file to be saved if any edits were made
         if default > 0:
-            Configurable.save_config()
+            global __CONFIG_DIRTY__
+            __CONFIG_DIRTY__ = True
 
         # Print registrations
         if __PRINT_REGISTRATIONS__:
@@ -81,11 +133,38 @@ class Configurable:
     @staticmethod
     def save_config() -> None:
         """Save the configuration to disk"""
-        open(__CONFIG_FILE__, "w").writelines(Configurable.make_config())
+        global __CONFIG_DIRTY__
+
+        # Serialize before touching the file, and swap it in atomically,
+        # so a failed save never leaves a truncated config behind
+        config = Configurable.make_config()
+        temp_file = __CONFIG_FILE__ + ".tmp"
+        try:
+            # Always utf-8, orjson leaves non-ascii characters unescaped and the config is read back as utf-8
+            with open(temp_file, "w", encoding="utf-8", buffering=1 << 20) as f:
+                f.write(config)
+            os.replace(temp_file, __CONFIG_FILE__)
+        except BaseException:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+        __CONFIG_DIRTY__ = False
+
+    @staticmethod
+    def save_config_if_dirty() -> None:
+        """Save the configuration to disk if it has changed since it was last saved"""
+        if __CONFIG_DIRTY__:
+            Configurable.save_config()
     
     @staticmethod
     def make_config() -> str:
         """Make a config json from the current configuration"""
+        if orjson is not None:
+            # Dict fields may have non-str keys. Values orjson can't write, e.g. huge ints, use json below.
+            try:
+                return orjson.dumps(__CONFIGURABLES__, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+            except TypeError:
+                pass
         return json.dumps(__CONFIGURABLES__, indent=4)
 
     def make_name(self) -> str:
@@ -94,6 +173,9 @@ class Configurable:
         Uses the string representation of the class if it has been overwritten with `__str__`, or the class name otherwise."""
         return str(self.__class__.__name__).lower() if str(self)[0] == "<" else str(self)
 
+# Save any pending changes once on exit, instead of on every registration
+atexit.register(Configurable.save_config_if_dirty)
+
 if __name__ == "__main__":
     class Testi(Configurable):
         def __init__(self) -> None:
@@ -10,9 +10,32 @@ except ImportError:
         exit(1)
 
 import json
+import mmap
+import multiprocessing
 import numpy
 import os
 
+# Optional, parses the pattern files faster
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def __load_json_file__(file: str):
+    """Loads a pattern json file, memory-mapped when orjson is installed.
+
+    Args:
+    - file (`str`): The json file.
+    """
+    with open(file, "rb") as f:
+        if orjson is None or os.fstat(f.fileno()).st_size == 0:
+            return json.loads(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            return orjson.loads(view)
+
+# Directory the gifs are written to
+__OUTPUT_DIR__ = "gifs"
+
 def __save_frames_as_gif__(frames: numpy.ndarray, output_dir: str, gif_name: str, fps: int = 8):
     """Saves a list of frames as a gif to the given output directory.
     
@@ -24,55 +47,83 @@ def __save_frames_as_gif__(frames: numpy.ndarray, output_dir: str, gif_name: str
     """
 
     # If the output dir does not exist, create it
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+    # exist_ok, as other processes may create it concurrently
+    os.makedirs(output_dir, exist_ok=True)
 
     # Save the gif file
+    # ImageSequenceClip treats anything but a list as a folder name, so pass the frames as a list of views
     clip = moviepy.editor.ImageSequenceClip(list(frames), fps=fps)
     clip.write_gif(os.path.join(output_dir, gif_name + ".gif"), fps=fps)
 
 
-def __frames_from_lists__(lists: list) -> numpy.ndarray:
-    """Converts a list of arrays into a list of frames.
-    
+def __gif_name__(file: str) -> str:
+    """Returns the name of the gif for a json file, without extension.
+
+    Args:
+    - file (`str`): The json file.
+
+    Returns:
+    - `str`: The gif name.
+    """
+    return os.path.splitext(os.path.basename(file))[0]
+
+def __is_up_to_date__(file: str) -> bool:
+    """Whether the gif of a json file exists and is not older than the json file.
+
     Args:
-    - lists (`list`): The list of arrays.
+    - file (`str`): The json file.
 
     Returns:
-    - `numpy.ndarray`: The list of frames.
+    - `bool`: Whether the gif is up to date.
     """
-    return [numpy.array(_list, dtype=numpy.uint8) for _list in lists]
+    gif = os.path.join(__OUTPUT_DIR__, __gif_name__(file) + ".gif")
+    return os.path.exists(gif) and os.path.getmtime(gif) >= os.path.getmtime(file)
+
+def __convert_one__(file: str):
+    """Converts a single json file to a gif.
+
+    Args:
+    - file (`str`): The json file.
+    """
+    json_pattern = __load_json_file__(file)
+
+    iters = [iteration["iteration"] for iteration in json_pattern["pattern"]]
 
-def convert(files: 'list[str]'):
+    # Generate a grid of RGB frames for gif generation
+    frames = numpy.zeros((len(iters), 6, 4, 3), dtype=numpy.uint8)
+
+    for i, iteration in enumerate(iters):
+        # Coords may be ints or digit strings, numpy parses both to integers
+        coords = numpy.array([motor_data["coord"] for motor_data in iteration], dtype=numpy.int16)
+        amps = numpy.array([motor_data["amplitude"] for motor_data in iteration], dtype=numpy.uint8)
+
+        # The first digit of a coord is the column, the second the row
+        col_coords, row_coords = numpy.divmod(coords, 10)
+        frames[i, row_coords - 1, col_coords - 1, :] = amps[:, None]
+
+    __save_frames_as_gif__(frames, __OUTPUT_DIR__, __gif_name__(file))
+
+def convert(files: 'list[str]', force: bool = False, parallel: bool = True):
     """Converts a list of json files to gifs.
+    Files are converted in parallel, one process per CPU core.
+    Files whose gif is newer than the json file are skipped.
+
+    On Windows and macOS, worker processes re-import the calling script.
+    Call this from inside an `if __name__ == "__main__":` block, or pass `parallel=False`.
 
     Args:
     - files (`list[str]`): The list of json files.
+    - force (`bool`, optional): Whether to convert files with an up to date gif as well. Defaults to `False`.
+    - parallel (`bool`, optional): Whether to convert the files in multiple processes. Defaults to `True`.
     """
-    for file in files:
-        with open(file, "r") as f:
-            json_pattern = json.load(f)
-
-        iters = [iteration["iteration"] for iteration in json_pattern["pattern"]]
-
-        # Generate a numpy grid for gif generation
-        grids = [
-            [[[0, 0, 0] for _ in range(0, 4)] for _ in range(0, 6)]
-            for _ in range(0, len(iters))
-        ]
-
-        # Generate numpy array for numpy output
-        np_grid = [
-            [[0 for _ in range(0, 4)] for _ in range(0, 6)]
-            for _ in range(0, len(iters))
-        ]
-
-        for i, iteration in enumerate(iters):
-            for motor_data in iteration:
-                col_coord = int(str(motor_data["coord"])[0])
-                row_coord = int(str(motor_data["coord"])[1])
-                amp = motor_data["amplitude"]
-                grids[i][row_coord - 1][col_coord - 1] = [amp, amp, amp]
-                np_grid[i][row_coord - 1][col_coord - 1] = amp
-
-        __save_frames_as_gif__(__frames_from_lists__(grids), "gifs", file.replace(".json", ".gif"))
\ No newline at end of file
+    if not force:
+        files = [file for file in files if not __is_up_to_date__(file)]
+
+    # Not worth spawning processes for a single file
+    if not parallel or len(files) <= 1:
+        for file in files:
+            __convert_one__(file)
+        return
+
+    with multiprocessing.Pool(min(os.cpu_count() or 1, len(files))) as pool:
+        pool.map(__convert_one__, files)